@@ -89,35 +89,46 @@ class Builder(object):
 
         # A font collection can share tables. When GPOS is shared in the original
         # font, make sure we add the same data so that the new GPOS is also shared.
-        spacing_by_offset = {}
+        fonts_by_offset = {}
+        fonts_configs_and_offsets = []
         for font in self.font.fonts_in_collection:
             config = self.config.for_font(font)
             if config is None:
                 logger.info('Skipping by config: "%s"', font)
                 continue
-            if EastAsianSpacing.font_has_feature(font):
-                logger.info('Feature already exists: "%s"', font)
-                return
             reader_offset = font.reader_offset("GPOS")
             # If the font does not have `GPOS`, `reader_offset` is `None`.
             # Create a shared `GPOS` for all fonts in the case. e.g., BIZ-UD.
-            spacing_entry = spacing_by_offset.get(reader_offset)
+            fonts = fonts_by_offset.get(reader_offset)
+            # If the `GPOS` is shared, it is already checked to not have the
+            # feature.
+            if not fonts and EastAsianSpacing.font_has_feature(font):
+                logger.info('Feature already exists: "%s"', font)
+                return
             logger.info('%d "%s" lang=%s GPOS=%d%s', font.font_index, font,
                         config.language, reader_offset if reader_offset else 0,
-                        ' (shared)' if spacing_entry else '')
-            if spacing_entry:
-                spacing, fonts = spacing_entry
-                # Different faces may have different set of glyphs. Unite them.
-                await spacing.add_glyphs(font, config)
+                        ' (shared)' if fonts else '')
+            if fonts:
                 fonts.append(font)
-                continue
-            spacing = EastAsianSpacing()
-            await spacing.add_glyphs(font, config)
-            spacing_by_offset[reader_offset] = (spacing, [font])
+            else:
+                fonts_by_offset[reader_offset] = [font]
+            fonts_configs_and_offsets.append((font, config, reader_offset))
+
+        # Add glyphs one font at a time in the face order. All fonts share the
+        # `GlyphTypeCache` of the collection, and the results depend on the
+        # order fonts are added to it.
+        spacing_by_offset = {
+            reader_offset: EastAsianSpacing()
+            for reader_offset in fonts_by_offset
+        }
+        for font, config, reader_offset in fonts_configs_and_offsets:
+            # Different faces may have different set of glyphs. Unite them.
+            await spacing_by_offset[reader_offset].add_glyphs(font, config)
 
         # Add to each font using the united `EastAsianSpacing`s.
         built_fonts = []
-        for spacing, fonts in spacing_by_offset.values():
+        for reader_offset, fonts in fonts_by_offset.items():
+            spacing = spacing_by_offset[reader_offset]
             if not spacing.can_add_to_font:
                 logger.info('Skipping due to no pairs: "%s"',
                             list(font.font_index for font in fonts))
@@ -158,10 +158,10 @@ class CollectionConfig(DefaultConfig):
             if isinstance(languages, str):
                 languages = languages.split(',')
             if len(languages) == 1:
-                return itertools.zip_longest(indices, (),
-                                             fillvalue=languages[0])
-            return itertools.zip_longest(indices, languages)
-        return itertools.zip_longest(indices, ())
+                return list(
+                    itertools.zip_longest(indices, (), fillvalue=languages[0]))
+            return list(itertools.zip_longest(indices, languages))
+        return list(itertools.zip_longest(indices, ()))
 
 
 Config.default = DefaultConfig()
@@ -2,8 +2,11 @@
 import argparse
 import asyncio
 import difflib
+import heapq
+import io
 import itertools
 import logging
+import operator
 import os
 import pathlib
 import re
@@ -18,12 +21,15 @@ logger = logging.getLogger('dump')
 
 
 class TableEntry(object):
+    __slots__ = ('reader', 'tag', 'offset', 'size', 'indices', 'gap')
+
     def __init__(self, reader, tag, offset, size, indices):
         self.reader = reader
         self.tag = tag
         self.offset = offset
         self.size = size
         self.indices = indices
+        self.gap = 0
 
     def read_data(self):
         file = self.reader.file
@@ -39,29 +45,35 @@ class TableEntry(object):
 
     @staticmethod
     def read_font(font):
-        fonts = enumerate(font.ttfonts)
-        entries = (TableEntry.read_ttfont(ttfont, index)
-                   for index, ttfont in fonts)
-        entries = itertools.chain.from_iterable(entries)
+        # Each font has only a few dozen tables. Sort each and merge them.
+        # `heapq.merge` is stable, so `indices` of merged rows are ascending.
+        key = operator.attrgetter('offset')
+        entries = [
+            sorted(TableEntry.read_ttfont(ttfont, index), key=key)
+            for index, ttfont in enumerate(font.ttfonts)
+        ]
+        entries = heapq.merge(*entries, key=key)
         entries = TableEntry.merge_indices(entries)
         return entries
 
     @staticmethod
     def read_ttfont(ttfont, index):
         reader = ttfont.reader
-        tags = reader.keys()
-        for tag in tags:
-            entry = reader.tables[tag]
-            yield TableEntry(reader, tag, entry.offset, entry.length, [index])
+        return [
+            TableEntry(reader, tag, entry.offset, entry.length, [index])
+            for tag, entry in reader.tables.items()
+        ]
 
     @staticmethod
     def merge_indices(rows):
         """For font collections (TTC), shared tables appear multiple times.
-        Merge them to a row that has a list of face indices."""
+        Merge them to a row that has a list of face indices.
+
+        The `rows` must be sorted by their offsets."""
         merged = []
         last = None
         next_offset = 0
-        for row in sorted(rows, key=lambda row: row.offset):
+        for row in rows:
             assert len(row.indices) == 1
             if last and row.offset == last.offset:
                 assert row.size == last.size
@@ -74,6 +86,16 @@ class TableEntry(object):
             next_offset = row.offset + row.size
         return merged
 
+    @staticmethod
+    def tags_by_index(entries, num_fonts):
+        """Returns a list of table tags for each font index.
+        Tables shared by multiple fonts are listed only in the first font."""
+        tags_by_index = [[] for _ in range(num_fonts)]
+        for entry in entries:
+            # `entry.indices` is in ascending order; see `read_font`.
+            tags_by_index[entry.indices[0]].append(entry.tag)
+        return tags_by_index
+
     @staticmethod
     def filter_entries_by_binary_diff(entries, src_entries):
         """Remove entries that are binary-equal from `entries` and `src_entries`."""
@@ -121,32 +143,39 @@ class Dump(object):
         Supports reading all fonts in TTCollection.
         The output can identify which tables are shared across multiple fonts."""
         if sort is None or sort == 'tag':
-            entries = sorted(entries, key=lambda entry: entry.tag)
+            entries = sorted(entries, key=operator.attrgetter('tag'))
             header_format = "Tag  {1:10}"
-            row_format = "{0} {2:10,d} {4}"
+
+            def format_row(entry):
+                return f'{entry.tag} {entry.size:10,d} {entry.indices}'
         else:
             assert sort == 'offset'
             header_format = "{0:8} Tag  {1:10} {2:5}"
-            row_format = "{1:08X} {0} {2:10,d} {3:5,d} {4}"
-        print(header_format.format("Offset", "Size", "Gap"), file=out_file)
+
+            def format_row(entry):
+                return (f'{entry.offset:08X} {entry.tag} {entry.size:10,d} '
+                        f'{entry.gap:5,d} {entry.indices}')
+
+        # Format into a buffer and write it at once, instead of writing to
+        # `out_file` for each row.
+        buffer = io.StringIO()
+        write = buffer.write
+        write(header_format.format("Offset", "Size", "Gap") + '\n')
+        sum_data = sum_gap = 0
         for entry in entries:
-            print(row_format.format(entry.tag, entry.offset, entry.size,
-                                    entry.gap, entry.indices),
-                  file=out_file)
+            write(format_row(entry) + '\n')
+            sum_data += entry.size
+            sum_gap += entry.gap
             tag = entry.tag
             if features and (tag == "GPOS" or tag == "GSUB"):
                 Dump.dump_features(font,
                                    entry.indices[0],
                                    tag,
-                                   out_file=out_file)
+                                   out_file=buffer)
 
-        sum_data = sum_gap = 0
-        for entry in entries:
-            sum_data += entry.size
-            sum_gap += entry.gap
-        print("Total: {0:,}\nData: {1:,}\nGap: {2:,}\nTables: {3}".format(
-            sum_data + sum_gap, sum_data, sum_gap, len(entries)),
-              file=out_file)
+        write("Total: {0:,}\nData: {1:,}\nGap: {2:,}\nTables: {3}\n".format(
+            sum_data + sum_gap, sum_data, sum_gap, len(entries)))
+        print(buffer.getvalue(), end='', file=out_file)
 
     @staticmethod
     def dump_features(font, face_index, tag, out_file=sys.stdout):
@@ -194,40 +223,33 @@ class Dump(object):
             num_fonts = len(font.fonts_in_collection)
         else:
             num_fonts = 1
+        tables_by_index = TableEntry.tags_by_index(entries, num_fonts)
         ttx_paths = []
-        procs = []
-        for index in range(num_fonts):
-            tables = []
-            remaining = []
-            for entry in entries:
-                if index in entry.indices:
-                    tables.append(entry.tag)
-                else:
-                    remaining.append(entry)
-            entries = remaining
+        jobs = []
+        ttfonts = font.ttfonts
+        for index, tables in enumerate(tables_by_index):
             # Skip ttx if there are no unique tables for this font.
             if len(tables) == 0:
                 ttx_paths.append(None)
                 continue
-            args = ['ttx', '-sf']
-            if logger.getEffectiveLevel() >= logging.INFO:
-                args.append('-q')
             if font.is_collection:
                 indexed_ttx_name = f'{ttx_path.stem}-{index}{ttx_path.suffix}'
-                indexed_ttx_path = ttx_path.parent / indexed_ttx_name
-                args.append(f'-y{index}')
-                args.append(f'-o{indexed_ttx_path}')
-                ttx_paths.append(indexed_ttx_path)
+                out_path = ttx_path.parent / indexed_ttx_name
             else:
-                args.append(f'-o{ttx_path}')
-                ttx_paths.append(ttx_path)
-            args.extend((f'-t{table}' for table in tables))
-            args.append(str(font.path))
-            logger.debug('run_ttx: %s', args)
-            procs.append(await asyncio.create_subprocess_exec(*args))
-        logger.debug("Awaiting %d dump_ttx for %s", len(procs), font)
-        tasks = list((asyncio.create_task(p.wait()) for p in procs))
-        await asyncio.wait(tasks)
+                out_path = ttx_path
+            ttx_paths.append(out_path)
+            jobs.append((ttfonts[index], out_path, tables))
+
+        def save_xml():
+            # Fonts in a collection share the file object of the reader.
+            # Dump them sequentially so that seeks and reads don't interleave.
+            for ttfont, out_path, tables in jobs:
+                logger.debug('save_xml: %s %s', out_path, tables)
+                ttfont.saveXML(str(out_path), tables=tables, splitTables=True)
+
+        logger.debug("Awaiting %d dump_ttx for %s", len(jobs), font)
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, save_xml)
         logger.debug("dump_ttx completed: %s", font)
         return ttx_paths
 
@@ -254,6 +276,7 @@ class Dump(object):
     @staticmethod
     async def dump_font(font, output=sys.stdout, ttx=False, **kwargs):
         logger.info('dump_font %s', font.path)
+        # Read the entries once for both the tables list and the TTX.
         entries = TableEntry.read_font(font)
         Dump.dump_tables(font, entries=entries, out_file=output, **kwargs)
         if ttx:
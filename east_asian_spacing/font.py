@@ -1,8 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import collections.abc
+import functools
 import itertools
 import logging
+import os
 import pathlib
+import struct
+import sys
 
 from fontTools.ttLib import newTable
 from fontTools.ttLib import TTFont
@@ -13,19 +18,54 @@ import uharfbuzz as hb
 logger = logging.getLogger('font')
 
 
+class _LazyFontList(collections.abc.Sequence):
+    """A sequence of `Font`s in a collection, created on the first access.
+
+    Tools that pick one font by index don't create other fonts."""
+    def __init__(self, count, create_font):
+        self._fonts = [None] * count
+        self._create_font = create_font
+
+    def __len__(self):
+        return len(self._fonts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        font = self._fonts[index]
+        if font is None:
+            font = self._create_font(index % len(self))
+            self._fonts[index] = font
+        return font
+
+    def created_fonts(self):
+        return (font for font in self._fonts if font is not None)
+
+
 class Font(object):
+    # `__dict__` is kept for `functools.cached_property`, and for caches other
+    # modules attach to fonts.
+    __slots__ = ('_byte_array', '_debug_names', 'font_index',
+                 '_fonts_in_collection', '_fullwidth_advance', '_hbblob',
+                 '_hbfont', 'horizontal_font', 'is_vertical',
+                 '_modified_tables', 'parent_collection', '_path', '_path_str',
+                 'ttcollection', 'ttfont', '_vertical_font', '__dict__')
+
     def __init__(self):
         self._byte_array = None
+        self._debug_names = {}
         self.font_index = None
         self._fonts_in_collection = None
+        self._hbblob = None
         self._hbfont = None
         self.horizontal_font = None
         self.is_vertical = False
+        self._modified_tables = set()
         self.parent_collection = None
-        self.path = None
+        self._path = None
+        self._path_str = None
         self.ttcollection = None
         self.ttfont = None
-        self._units_per_em = None
         self._vertical_font = None
 
     @staticmethod
@@ -36,16 +76,31 @@ class Font(object):
         self = Font()
         self.path = path
         if Font.is_ttc_font_extension(self.path.suffix):
-            self.ttcollection = TTCollection(path, allowVID=True)
-            self._fonts_in_collection = tuple(
-                self._create_font_in_collection(index, ttfont)
-                for index, ttfont in enumerate(self.ttcollection))
+            # `lazy=True` reads tables on demand from the shared file, instead
+            # of reading the whole file into memory for each font.
+            self.ttcollection = TTCollection(self._path_str,
+                                             allowVID=True,
+                                             lazy=True)
+            self._fonts_in_collection = _LazyFontList(
+                len(self.ttcollection),
+                lambda index: self._create_font_in_collection(
+                    index, self.ttcollection[index]))
             logger.info("%d fonts found in the collection",
                         len(self.ttcollection))
             return self
-        self.ttfont = TTFont(path, allowVID=True)
+        self.ttfont = TTFont(self._path_str, allowVID=True)
         return self
 
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        self._path = path
+        # Keep the `str` too; fontTools, HarfBuzz and `os.stat` need it.
+        self._path_str = None if path is None else os.fspath(path)
+
     def _clone(self):
         clone = Font()
         clone.font_index = self.font_index
@@ -55,7 +110,6 @@ class Font(object):
         clone.path = self.path
         clone.ttcollection = self.ttcollection
         clone.ttfont = self.ttfont
-        clone._units_per_em = self._units_per_em
         clone._vertical_font = None
         return clone
 
@@ -83,15 +137,26 @@ class Font(object):
         return self
 
     def self_and_derived_fonts(self, create=True):
-        yield self
-        if not self.is_vertical and (create or self._vertical_font):
-            vertical = self.vertical_font
-            if vertical:
-                yield vertical
-        if self.is_collection:
-            assert self._fonts_in_collection is not None
-            yield from itertools.chain(*(font.self_and_derived_fonts(
-                create=create) for font in self._fonts_in_collection))
+        # Walk with an explicit stack instead of nested generators. Each item
+        # is `(font, expand)`; derived vertical fonts are yielded but not
+        # expanded. Children are pushed in reverse to keep the pre-order.
+        stack = [(self, True)]
+        while stack:
+            font, expand = stack.pop()
+            yield font
+            if not expand:
+                continue
+            if font.is_collection:
+                assert font._fonts_in_collection is not None
+                children = font._fonts_in_collection
+                if not create:
+                    # Fonts not created yet have nothing to walk.
+                    children = list(children.created_fonts())
+                stack.extend((child, True) for child in reversed(children))
+            if not font.is_vertical and (create or font._vertical_font):
+                vertical = font.vertical_font
+                if vertical:
+                    stack.append((vertical, False))
 
     def _set_path(self, path):
         assert self.is_root
@@ -100,7 +165,11 @@ class Font(object):
             assert font.path == old_path
             font.path = path
             font._byte_array = None
+            font._debug_names = {}
+            font._hbblob = None
             font._hbfont = None
+            # The offsets are for the file at the old path.
+            font.__dict__.pop('_table_offsets', None)
 
     @property
     def fonts_in_collection(self):
@@ -119,8 +188,9 @@ class Font(object):
         vertical_font.horizontal_font = self
         self._vertical_font = vertical_font
         if self.is_collection:
-            vertical_font._fonts_in_collection = tuple(
-                font.vertical_font for font in self.fonts_in_collection)
+            vertical_font._fonts_in_collection = _LazyFontList(
+                len(self.fonts_in_collection),
+                lambda index: self.fonts_in_collection[index].vertical_font)
             assert self.parent_collection is None
         elif self.parent_collection:
             vertical_font.parent_collection = self.parent_collection.vertical_font
@@ -132,27 +202,48 @@ class Font(object):
         elif isinstance(out_path, str):
             out_path = pathlib.Path(out_path)
         logger.info("Saving to: \"%s\"", out_path)
+        out_path_str = os.fspath(out_path)
+        size_before = os.stat(self._path_str).st_size
         if self.ttcollection:
-            for ttfont in self.ttcollection:
-                self._before_save(ttfont)
-            self.ttcollection.save(str(out_path))
+            # Fonts not created yet have not loaded nor modified any tables.
+            for font in self._fonts_in_collection.created_fonts():
+                self._before_save(font.ttfont, font._modified_tables)
+            if out_path.exists() and out_path.samefile(self.path):
+                # Tables are read lazily from `self.path`. Don't overwrite it
+                # until all tables are written.
+                temp_path_str = out_path_str + '.tmp'
+                self.ttcollection.save(temp_path_str)
+                os.replace(temp_path_str, out_path_str)
+            else:
+                self.ttcollection.save(out_path_str)
         else:
-            self._before_save(self.ttfont)
-            self.ttfont.save(str(out_path))
+            self._before_save(self.ttfont, self._modified_tables)
+            self.ttfont.save(out_path_str)
         self._set_path(out_path)
 
-        size_before = self.path.stat().st_size
-        size_after = out_path.stat().st_size
+        size_after = os.stat(out_path_str).st_size
         logger.info("File sizes: %d -> %d Delta: %d", size_before, size_after,
                     size_after - size_before)
 
+    def set_table_modified(self, tag):
+        """Marks the table as modified, so that `save()` compiles it."""
+        assert not self.is_vertical
+        self._modified_tables.add(tag)
+
     @staticmethod
-    def _before_save(ttfont):
-        # `TTFont.save()` compiles all loaded tables. Unload tables we know we did
-        # not modify, so that it copies instead of re-compile.
-        for key in ("CFF ", "GSUB", "name"):
-            if ttfont.isLoaded(key):
-                del ttfont.tables[key]
+    def _before_save(ttfont, modified_tables):
+        # `TTFont.save()` compiles all loaded tables. Unload tables we did not
+        # modify, so that it copies instead of re-compile. Pop from the dict
+        # directly, and only tables the reader can copy from.
+        reader = ttfont.reader
+        if reader is None:
+            return
+        tables = ttfont.tables
+        for tag in [
+                tag for tag in tables
+                if tag not in modified_tables and tag in reader
+        ]:
+            tables.pop(tag)
 
     @property
     def is_collection(self):
@@ -179,10 +270,11 @@ class Font(object):
         return self.reader.file
 
     def reader_offset(self, tag):
-        entry = self.reader.tables.get(tag)
-        if entry:
-            return entry.offset
-        return None
+        return self._table_offsets.get(tag)
+
+    @functools.cached_property
+    def _table_offsets(self):
+        return {tag: entry.offset for tag, entry in self.reader.tables.items()}
 
     @property
     def byte_array(self):
@@ -197,18 +289,42 @@ class Font(object):
             return self._hbfont
         if self.is_vertical:
             return self.horizontal_font.hbfont
-        byte_array = self.byte_array
-        hbface = hb.Face(byte_array, self.font_index or 0)
+        hbface = hb.Face(self.hbblob, self.font_index or 0)
         self._hbfont = hb.Font(hbface)
         return self._hbfont
 
+    @property
+    def hbblob(self):
+        """Returns the `hb.Blob` of the font file, shared by all fonts in the
+        collection."""
+        root = self.root_or_self
+        if root._hbblob is None:
+            # Old uharfbuzz may not have `hb.Blob` nor `Blob.from_file_path`.
+            from_file_path = getattr(getattr(hb, 'Blob', None),
+                                     'from_file_path', None)
+            if from_file_path:
+                # HarfBuzz maps the file to memory if possible, which avoids
+                # copying the whole file into `bytes`.
+                root._hbblob = from_file_path(root._path_str)
+            else:
+                root._hbblob = root.byte_array
+        return root._hbblob
+
     def debug_name(self, name_id):
         # name_id:
         # https://docs.microsoft.com/en-us/typography/opentype/spec/name#name-id-examples
+        # `__str__` calls this on every log. Cache to avoid decoding the
+        # `name` table each time.
+        try:
+            return self._debug_names[name_id]
+        except KeyError:
+            pass
+        result = None
         if self.ttfont:
             name = self.tttable("name")
-            return name.getDebugName(name_id)
-        return None
+            result = name.getDebugName(name_id)
+        self._debug_names[name_id] = result
+        return result
 
     def __str__(self):
         name = self.debug_name(4) or self.path.name
@@ -221,11 +337,9 @@ class Font(object):
             return f'{name} ({", ".join(attributes)})'
         return name
 
-    @property
+    @functools.cached_property
     def units_per_em(self):
-        if self._units_per_em is None:
-            self._units_per_em = self.tttable('head').unitsPerEm
-        return self._units_per_em
+        return self.tttable('head').unitsPerEm
 
     @property
     def fullwidth_advance(self):
@@ -249,25 +363,24 @@ class Font(object):
             logger.debug('fullwidth_advance=%d for "%s"', value, self)
         self._fullwidth_advance = value
 
-    @property
-    def script_and_langsys_tags(self, tags=("GSUB", "GPOS")):
-        result = ()
-        for tag in tags:
-            table = self.tttable(tag)
-            if not table:
-                continue
-            tag_result = Font.script_and_langsys_tags_for_table(table.table)
-            result = itertools.chain(result, tag_result)
-        return result
+    @functools.cached_property
+    def script_and_langsys_tags(self):
+        # This is for error messages before adding features, so caching is ok
+        # even though `GPOS` may be modified later.
+        return tuple(
+            itertools.chain.from_iterable(
+                Font.script_and_langsys_tags_for_table(tttable.table)
+                for tttable in (self.tttable("GSUB"), self.tttable("GPOS"))
+                if tttable))
 
     @staticmethod
     def script_and_langsys_tags_for_table(table):
         scripts = table.ScriptList.ScriptRecord
         for script_record in scripts:
-            script_tag = script_record.ScriptTag
+            script_tag = Font._intern_tag(script_record.ScriptTag)
             yield (script_tag, None)
             for lang_sys in script_record.Script.LangSysRecord:
-                yield (script_tag, lang_sys.LangSysTag)
+                yield (script_tag, Font._intern_tag(lang_sys.LangSysTag))
 
     def raise_require_language(self):
         raise AssertionError(
@@ -275,8 +388,7 @@ class Font(object):
             "This font has following scripts:\n" + "\n".join(
                 "  {} {}".format(t[0], "(default)" if t[1] is None else t[1])
                 for t in sorted(set(self.script_and_langsys_tags),
-                                key=lambda t: t[0] +
-                                ("" if t[1] is None else t[1]))))
+                                key=lambda t: (t[0], t[1] or ""))))
 
     def glyph_names(self, glyph_ids):
         ttfont = self.ttfont
@@ -293,16 +405,62 @@ class Font(object):
                 return True
         return False
 
-    @staticmethod
-    def _has_tttable_feature(tttable, feature_tag):
-        return (tttable
-                and Font._has_ottable_feature(tttable.table, feature_tag))
-
     def has_gpos_feature(self, feature_tag):
-        return Font._has_tttable_feature(self.tttable('GPOS'), feature_tag)
+        # `GPOS` may be modified by `EastAsianSpacing`, so don't cache.
+        return feature_tag in self._feature_tags('GPOS')
 
     def has_gsub_feature(self, feature_tag):
-        return Font._has_tttable_feature(self.tttable('GSUB'), feature_tag)
+        return feature_tag in self._gsub_feature_tags
+
+    @functools.cached_property
+    def _gsub_feature_tags(self):
+        # `GSUB` is not modified, so the tags can be cached. `has_gsub_feature`
+        # is called on every `vertical_font` if the font doesn't have "vert".
+        return self._feature_tags('GSUB')
+
+    def _feature_tags(self, tag):
+        ttfont = self.ttfont
+        reader = ttfont.reader
+        if ttfont.isLoaded(tag) or reader is None or reader.flavor:
+            # The table may be modified, or the file may be compressed.
+            tttable = ttfont.get(tag)
+            ottable = tttable.table if tttable else None
+            if not ottable or not ottable.FeatureList:
+                return frozenset()
+            return frozenset(
+                Font._intern_tag(feature_record.FeatureTag)
+                for feature_record in ottable.FeatureList.FeatureRecord)
+        return self._feature_tags_raw(tag)
+
+    @staticmethod
+    def _intern_tag(tag):
+        # Interned tags compare by identity with literals such as "vert".
+        # fontTools may give `Tag`, a `str` subclass `sys.intern` rejects.
+        return sys.intern(str(tag))
+
+    _uint16_struct = struct.Struct('>H')
+    _feature_record_struct = struct.Struct('>4sH')
+
+    def _feature_tags_raw(self, tag):
+        """Returns feature tags of the `GSUB` or `GPOS` table by reading the
+        `FeatureList` from the file, without decompiling the table."""
+        offset = self.reader_offset(tag)
+        if offset is None:
+            return frozenset()
+        file = self.file
+        # The header is: majorVersion, minorVersion, scriptListOffset,
+        # featureListOffset, ..., all `uint16`.
+        file.seek(offset + 6)
+        feature_list_offset, = Font._uint16_struct.unpack(file.read(2))
+        if not feature_list_offset:
+            return frozenset()
+        file.seek(offset + feature_list_offset)
+        count, = Font._uint16_struct.unpack(file.read(2))
+        data = file.read(count * Font._feature_record_struct.size)
+        records = Font._feature_record_struct.iter_unpack(data)
+        return frozenset(
+            Font._intern_tag(feature_tag.decode('latin-1'))
+            for feature_tag, _ in records)
 
     def add_gpos_table(self):
         logger.info("Adding GPOS table")
@@ -318,6 +476,7 @@ class Font(object):
         table.LookupList.Lookup = []
         gpos = ttfont['GPOS'] = newTable('GPOS')
         gpos.table = table
+        self.set_table_modified('GPOS')
         return gpos
 
     def create_script_record(self):
@@ -332,17 +491,19 @@ class Font(object):
         script_record.Script = script
         return script_record
 
-    _ot_extensions = set(ext.casefold() for ext in ('.otf', '.ttf'))
-    _ttc_extensions = set(ext.casefold() for ext in ('.otc', '.ttc'))
+    # Extensions are ASCII, so `str.lower()` is enough and faster than
+    # `str.casefold()`.
+    _ot_extensions = frozenset(('.otf', '.ttf'))
+    _ttc_extensions = frozenset(('.otc', '.ttc'))
     _font_extensions = _ttc_extensions | _ot_extensions
 
     @staticmethod
     def is_ttc_font_extension(extension):
-        return extension.casefold() in Font._ttc_extensions
+        return extension.lower() in Font._ttc_extensions
 
     @staticmethod
     def is_font_extension(extension):
-        return extension.casefold() in Font._font_extensions
+        return extension.lower() in Font._font_extensions
 
 
 if __name__ == '__main__':
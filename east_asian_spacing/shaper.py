@@ -64,6 +64,10 @@ class ShapeResult(object):
     def filter(self, predicate):
         self._glyphs = filter(predicate, self._glyphs)
 
+    def filter_by_advance(self, advance):
+        # Avoids calling a `lambda` per glyph as `filter` would.
+        self._glyphs = (g for g in self._glyphs if g.advance == advance)
+
     def freeze(self):
         """Freeze the internal generator as a tuple.
         Once frozen, it can iterate multiple times."""
@@ -71,11 +75,9 @@ class ShapeResult(object):
 
     @property
     def glyph_ids(self):
-        glyph_ids = (g.glyph_id for g in self._glyphs)
         # Filter out ".notdef" glyphs. Glyph 0 must be assigned to a .notdef glyph.
         # https://docs.microsoft.com/en-us/typography/opentype/spec/recom#glyph-0-the-notdef-glyph
-        glyph_ids = filter(lambda glyph_id: glyph_id, glyph_ids)
-        return glyph_ids
+        return (g.glyph_id for g in self._glyphs if g.glyph_id)
 
     def set_text(self, text):
         self.freeze()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 import argparse
 import asyncio
+import functools
+import itertools
 import logging
 import math
 import sys
@@ -19,6 +21,14 @@ from east_asian_spacing.shaper import show_dump_images
 
 logger = logging.getLogger('spacing')
 
+# Shape other languages only to assert they are the same as the main ones.
+# They double the number of shapes, so they are off unless tests turn them on.
+_ASSERTIONS_ENABLED = False
+
+# Features for `GlyphSetTrio._shape`, allocated once.
+_FWID = ('fwid', )
+_FWID_VERT = ('fwid', 'vert')
+
 
 class GlyphSetTrio(object):
     def __init__(self, left=None, right=None, middle=None):
@@ -26,6 +36,7 @@ class GlyphSetTrio(object):
         self.right = right if right is not None else set()
         self.middle = middle if middle is not None else set()
         self._root_font = None  # For checking purposes.
+        self._glyph_names_cache = {}
 
     def assert_font(self, font):
         if self._root_font:
@@ -57,17 +68,29 @@ class GlyphSetTrio(object):
     def save_glyphs(self, output, prefix='', separator='\n'):
         for name, glyphs in self._name_and_glyphs:
             output.write(f'# {prefix}{name}\n')
-            glyphs = (str(glyph_id) for glyph_id in sorted(glyphs))
-            output.write(separator.join(glyphs))
+            output.write(separator.join(map(str, sorted(glyphs))))
             output.write('\n')
 
     def unite(self, other):
         if not other:
             return
+        self._glyph_names_cache.clear()
         self.left |= other.left
         self.middle |= other.middle
         self.right |= other.right
 
+    def unite_many(self, others):
+        """Unite `GlyphSetTrio`s, skipping `None`, with one `set.update` for
+        each of left, middle, and right."""
+        others = tuple(other for other in others if other)
+        if not others:
+            return
+        self._glyph_names_cache.clear()
+        chain = itertools.chain.from_iterable
+        self.left.update(chain(other.left for other in others))
+        self.middle.update(chain(other.middle for other in others))
+        self.right.update(chain(other.right for other in others))
+
     async def add_glyphs(self, font, config):
         self.assert_font(font)
         if not await Shaper.ensure_fullwidth_advance(font):
@@ -79,17 +102,53 @@ class GlyphSetTrio(object):
                                        self.get_period_comma(font, config),
                                        self.get_colon_semicolon(font, config),
                                        self.get_exclam_question(font, config))
-        for result in results:
-            self.unite(result)
+        self.unite_many(results)
         self.add_to_cache(font)
         self.assert_glyphs_are_disjoint()
 
     @staticmethod
     async def _shape(font, unicodes, language=None):
-        text = ''.join(chr(c) for c in unicodes)
+        text = ''.join(map(chr, unicodes))
+        # Fonts in a collection that share the tables used for shaping produce
+        # the same results. Cache them in the root font.
+        # While shaping, cache the task so that concurrent calls with the same
+        # key wait for one shaping, instead of shaping in parallel. When it
+        # completes, replace it with the result, or remove it on failures.
+        cache = GlyphSetTrio._shape_cache(font)
+        key = GlyphSetTrio._shape_cache_key(font, language, text)
+        result = cache.get(key)
+        if result is None:
+            result = asyncio.ensure_future(
+                GlyphSetTrio._shape_glyphs(font, text, language))
+            cache[key] = result
+
+            def done(task):
+                if task.cancelled() or task.exception():
+                    if cache.get(key) is task:
+                        del cache[key]
+                    return
+                cache[key] = task.result()
+
+            result.add_done_callback(done)
+        if asyncio.isfuture(result):
+            result = await result
+        # The result is a `frozenset` shared by the cache. Callers rebind
+        # instead of modifying it.
+        return result
+
+    @staticmethod
+    async def _shape_languages(font, unicodes, languages):
+        # Shape all languages at once, including ones only for assertions, so
+        # that `hb-shape` subprocesses can run in parallel.
+        return await asyncio.gather(
+            *(GlyphSetTrio._shape(font, unicodes, language=language)
+              for language in languages))
+
+    @staticmethod
+    async def _shape_glyphs(font, text, language):
         # Unified code points (e.g., U+2018-201D) in most fonts are Latin glyphs.
         # Enable "fwid" feature to get fullwidth glyphs.
-        features = ['fwid', 'vert'] if font.is_vertical else ['fwid']
+        features = _FWID_VERT if font.is_vertical else _FWID
         shaper = Shaper(font,
                         language=language,
                         script='hani',
@@ -98,14 +157,34 @@ class GlyphSetTrio(object):
 
         # East Asian spacing applies only to fullwidth glyphs.
         em = font.fullwidth_advance
-        result.filter(lambda g: g.advance == em)
+        result.filter_by_advance(em)
 
         if logger.getEffectiveLevel() <= logging.DEBUG:
             result.freeze()
             if len(result):
                 logger.debug('ShapeResult=%s', result)
 
-        return set(result.glyph_ids)
+        return frozenset(result.glyph_ids)
+
+    # Tables that affect glyph IDs and advances of shaping results.
+    _shape_table_tags = ('cmap', 'GDEF', 'GSUB', 'GPOS')
+
+    @staticmethod
+    def _shape_cache_key(font, language, text):
+        tags = GlyphSetTrio._shape_table_tags
+        tags += ('vmtx', ) if font.is_vertical else ('hmtx', )
+        offsets = tuple(font.reader_offset(tag) for tag in tags)
+        return (offsets, font.is_vertical, font.fullwidth_advance, language,
+                text)
+
+    @staticmethod
+    def _shape_cache(font):
+        font = font.root_or_self
+        if hasattr(font, "east_asian_spacing_shapes_"):
+            return font.east_asian_spacing_shapes_
+        cache = dict()
+        font.east_asian_spacing_shapes_ = cache
+        return cache
 
     @staticmethod
     async def get_opening_closing(font, config):
@@ -116,7 +195,8 @@ class GlyphSetTrio(object):
             GlyphSetTrio._shape(font, opening),
             GlyphSetTrio._shape(font, config.cjk_middle))
         result = GlyphSetTrio(left, right, middle)
-        if font.is_vertical:
+        # Nothing to subtract from if there are no left/right glyphs.
+        if font.is_vertical and (left or right):
             # Left/right in vertical should apply only if they have `vert` glyphs.
             # YuGothic/UDGothic doesn't have 'vert' glyphs for U+2018/201C/301A/301B.
             horizontal = await GlyphSetTrio._shape(font.horizontal_font,
@@ -134,24 +214,23 @@ class GlyphSetTrio(object):
         text = config.cjk_period_comma
         if not text:
             return None
-        ja, zht = await asyncio.gather(
-            GlyphSetTrio._shape(font, text, language="JAN"),
-            GlyphSetTrio._shape(font, text, language="ZHT"))
-        if __debug__:
-            zhs, kor = await asyncio.gather(
-                GlyphSetTrio._shape(font, text, language="ZHS"),
-                GlyphSetTrio._shape(font, text, language="KOR"))
+        if _ASSERTIONS_ENABLED:
+            ja, zht, zhs, kor = await GlyphSetTrio._shape_languages(
+                font, text, ("JAN", "ZHT", "ZHS", "KOR"))
             assert zhs == ja
             assert kor == ja
             # Some fonts do not support ZHH, in that case, it may be the same as JAN.
             # For example, NotoSansCJK supports ZHH but NotoSerifCJK does not.
             # assert Shaper(font, text, language="ZHH", script="hani").glyph_ids_set() == zht
+        else:
+            ja, zht = await GlyphSetTrio._shape_languages(
+                font, text, ("JAN", "ZHT"))
         if ja == zht:
             if not config.language: font.raise_require_language()
             if config.language == "ZHT" or config.language == "ZHH":
-                ja.clear()
+                ja = frozenset()
             else:
-                zht.clear()
+                zht = frozenset()
         assert ja.isdisjoint(zht)
         result = GlyphSetTrio(ja, None, zht)
         result.assert_glyphs_are_disjoint()
@@ -164,15 +243,14 @@ class GlyphSetTrio(object):
         is_colon_semicolon_middle = config.is_colon_semicolon_middle
         result = GlyphSetTrio()
         if is_colon_semicolon_middle is None:
-            ja, zhs = await asyncio.gather(
-                GlyphSetTrio._shape(font, text, language="JAN"),
-                GlyphSetTrio._shape(font, text, language="ZHS"))
-            if __debug__ and not font.is_vertical:
-                zht, kor = await asyncio.gather(
-                    GlyphSetTrio._shape(font, text, language="ZHT"),
-                    GlyphSetTrio._shape(font, text, language="KOR"))
+            if _ASSERTIONS_ENABLED and not font.is_vertical:
+                ja, zhs, zht, kor = await GlyphSetTrio._shape_languages(
+                    font, text, ("JAN", "ZHS", "ZHT", "KOR"))
                 assert zht == ja
                 assert kor == ja
+            else:
+                ja, zhs = await GlyphSetTrio._shape_languages(
+                    font, text, ("JAN", "ZHS"))
             ja = result.add_from_cache(font, ja)
             zhs = result.add_from_cache(font, zhs)
             if not ja and not zhs:
@@ -180,9 +258,9 @@ class GlyphSetTrio(object):
             if ja == zhs:
                 if not config.language: font.raise_require_language()
                 if config.language == "ZHS":
-                    ja.clear()
+                    ja = frozenset()
                 else:
-                    zhs.clear()
+                    zhs = frozenset()
         else:
             glyphs = await GlyphSetTrio._shape(font,
                                                text,
@@ -217,37 +295,50 @@ class GlyphSetTrio(object):
             return None
         # Fullwidth exclamation mark and question mark are on left only in ZHS.
         text = config.cjk_exclam_question
-        ja, zhs = await asyncio.gather(
-            GlyphSetTrio._shape(font, text, language="JAN"),
-            GlyphSetTrio._shape(font, text, language="ZHS"))
-        if __debug__:
-            zht, kor = await asyncio.gather(
-                GlyphSetTrio._shape(font, text, language="ZHT"),
-                GlyphSetTrio._shape(font, text, language="KOR"))
+        if _ASSERTIONS_ENABLED:
+            ja, zhs, zht, kor = await GlyphSetTrio._shape_languages(
+                font, text, ("JAN", "ZHS", "ZHT", "KOR"))
             assert zht == ja
             assert kor == ja
+        else:
+            ja, zhs = await GlyphSetTrio._shape_languages(
+                font, text, ("JAN", "ZHS"))
         if ja == zhs:
             if not config.language: font.raise_require_language()
             if config.language == "ZHS":
-                ja.clear()
+                ja = frozenset()
             else:
-                zhs.clear()
+                zhs = frozenset()
         assert ja.isdisjoint(zhs)
         result = GlyphSetTrio(zhs, None, None)
         result.assert_glyphs_are_disjoint()
         return result
 
     class GlyphTypeCache(object):
+        # Glyph IDs are small dense integers. Keep the type of each glyph in a
+        # `bytearray` indexed by glyph ID, `0` if not cached.
+        _values = (None, "L", "M", "R")
+        _codes = {value: code for code, value in enumerate(_values)}
+
         def __init__(self):
-            self.type_by_glyph_id = dict()
+            self.types = bytearray()
 
         def add_glyphs(self, glyphs, value):
+            code = GlyphSetTrio.GlyphTypeCache._codes[value]
+            types = self.types
             for glyph_id in glyphs:
-                assert self.type_by_glyph_id.get(glyph_id, value) == value
-                self.type_by_glyph_id[glyph_id] = value
+                if glyph_id >= len(types):
+                    # Fonts in a collection may have different numbers of
+                    # glyphs. Grow as needed.
+                    types.extend(bytes(glyph_id + 1 - len(types)))
+                assert types[glyph_id] in (0, code)
+                types[glyph_id] = code
 
         def type_from_glyph_id(self, glyph_id):
-            return self.type_by_glyph_id.get(glyph_id, None)
+            types = self.types
+            if glyph_id >= len(types):
+                return None
+            return GlyphSetTrio.GlyphTypeCache._values[types[glyph_id]]
 
         @staticmethod
         def get(font, create=False):
@@ -269,15 +360,14 @@ class GlyphSetTrio(object):
 
         def add_to_trio(self, glyph_set_trio, glyphs):
             not_cached = set()
-            glyph_ids_by_value = {
-                None: not_cached,
-                "L": glyph_set_trio.left,
-                "M": glyph_set_trio.middle,
-                "R": glyph_set_trio.right
-            }
+            # Indexed by the codes in `types`.
+            glyph_ids_by_code = (not_cached, glyph_set_trio.left,
+                                 glyph_set_trio.middle, glyph_set_trio.right)
+            types = self.types
+            num_types = len(types)
             for glyph_id in glyphs:
-                value = self.type_from_glyph_id(glyph_id)
-                glyph_ids_by_value[value].add(glyph_id)
+                code = types[glyph_id] if glyph_id < num_types else 0
+                glyph_ids_by_code[code].add(glyph_id)
             return not_cached
 
     def add_to_cache(self, font):
@@ -288,6 +378,7 @@ class GlyphSetTrio(object):
         cache = GlyphSetTrio.GlyphTypeCache.get(font, create=False)
         if cache is None:
             return glyphs
+        self._glyph_names_cache.clear()
         return cache.add_to_trio(self, glyphs)
 
     @property
@@ -313,34 +404,80 @@ class GlyphSetTrio(object):
         feature_record.Feature.LookupCount = len(lookup_indices)
         features.append(feature_record)
 
-        scripts = table.ScriptList.ScriptRecord
-        for script_record in scripts:
-            default_lang_sys = script_record.Script.DefaultLangSys
-            if default_lang_sys:
-                logger.debug(
-                    "Adding Feature index %d to script '%s' DefaultLangSys",
-                    feature_index, script_record.ScriptTag)
-                default_lang_sys.FeatureIndex.append(feature_index)
-            for lang_sys in script_record.Script.LangSysRecord:
+        lang_syses = tuple(GlyphSetTrio._lang_syses(table))
+        if logger.isEnabledFor(logging.DEBUG):
+            for script_tag, lang_sys_tag, _ in lang_syses:
+                if lang_sys_tag is None:
+                    logger.debug(
+                        "Adding Feature index %d to script '%s' DefaultLangSys",
+                        feature_index, script_tag)
+                    continue
                 logger.debug(
                     "Adding Feature index %d to script '%s' LangSys '%s'",
-                    feature_index, script_record.ScriptTag,
-                    lang_sys.LangSysTag)
-                lang_sys.LangSys.FeatureIndex.append(feature_index)
+                    feature_index, script_tag, lang_sys_tag)
+        for _, _, lang_sys in lang_syses:
+            lang_sys.FeatureIndex.append(feature_index)
 
-    def build_lookup(self, font, lookups):
-        self.assert_font(font)
-        left, right, middle = (tuple(font.glyph_names(sorted(glyphs)))
-                               for glyphs in (self.left, self.right,
-                                              self.middle))
-        logger.info("Adding Lookups for %d left, %d right, %d middle glyphs",
-                    len(left), len(right), len(middle))
-        em = font.fullwidth_advance
+    @staticmethod
+    def _lang_syses(table):
+        """Yields `(script_tag, lang_sys_tag, lang_sys)` for all `LangSys` in
+        the table. `lang_sys_tag` is `None` for `DefaultLangSys`."""
+        for script_record in table.ScriptList.ScriptRecord:
+            script_tag = script_record.ScriptTag
+            default_lang_sys = script_record.Script.DefaultLangSys
+            if default_lang_sys:
+                yield (script_tag, None, default_lang_sys)
+            for lang_sys_record in script_record.Script.LangSysRecord:
+                yield (script_tag, lang_sys_record.LangSysTag,
+                       lang_sys_record.LangSys)
+
+    # Tables that determine glyph names. When `post` has no names (format 3),
+    # fontTools derives them from `cmap` and the number of glyphs in `maxp`.
+    _glyph_name_table_tags = ('CFF ', 'cmap', 'maxp', 'post')
+
+    def _glyph_names(self, font):
+        """Returns tuples of glyph names for left, right, middle,
+        middle + right, and left + middle + right.
+
+        Fonts in a collection sharing a `GPOS` add the same lookups, and they
+        usually share glyph names too. Cache the names for such fonts."""
+        key = tuple(
+            font.reader_offset(tag)
+            for tag in GlyphSetTrio._glyph_name_table_tags)
+        names = self._glyph_names_cache.get(key)
+        if names is not None:
+            return names
+        # Get all names by one call, then split them.
+        glyph_ids = sorted(self.glyph_ids)
+        glyph_names = tuple(font.glyph_names(glyph_ids))
+
+        def names_of(glyphs):
+            return tuple(name
+                         for glyph_id, name in zip(glyph_ids, glyph_names)
+                         if glyph_id in glyphs)
+
+        left = names_of(self.left)
+        right = names_of(self.right)
+        middle = names_of(self.middle)
+        # Concatenate once, `PairPosBuilder` and `ChainContextualRule` only
+        # read them.
+        middle_right = middle + right
+        names = (left, right, middle, middle_right, left + middle_right)
+        self._glyph_names_cache[key] = names
+        return names
+
+    @staticmethod
+    @functools.lru_cache(maxsize=128)
+    def _half_values(em, is_vertical):
+        """Returns `ValueRecord`s to adjust the left and right glyphs by half.
+
+        Fonts in a collection usually have the same `em`. The builders only
+        read the records, so they can be shared."""
         # When `em` is an odd number, ceil the advance. To do this, use floor
         # to compute the adjustment of the advance and the offset.
         half_em = math.floor(em / 2)
         assert half_em > 0
-        if font.is_vertical:
+        if is_vertical:
             left_half_value = buildValue({"YAdvance": -half_em})
             right_half_value = buildValue({
                 "YPlacement": half_em,
@@ -352,13 +489,23 @@ class GlyphSetTrio(object):
                 "XPlacement": -half_em,
                 "XAdvance": -half_em
             })
+        return (left_half_value, right_half_value)
+
+    def build_lookup(self, font, lookups):
+        self.assert_font(font)
+        (left, right, middle, middle_right,
+         left_middle_right) = self._glyph_names(font)
+        logger.info("Adding Lookups for %d left, %d right, %d middle glyphs",
+                    len(left), len(right), len(middle))
+        left_half_value, right_half_value = GlyphSetTrio._half_values(
+            font.fullwidth_advance, font.is_vertical)
         lookup_indices = []
 
         # Build lookup for adjusting the left glyph, using type 2 pair positioning.
         ttfont = font.ttfont
         pair_pos_builder = PairPosBuilder(ttfont, None)
         pair_pos_builder.addClassPair(None, left, left_half_value,
-                                      left + middle + right, None)
+                                      left_middle_right, None)
         lookup = pair_pos_builder.build()
         assert lookup
         lookup_indices.append(len(lookups))
@@ -378,7 +525,7 @@ class GlyphSetTrio(object):
 
         chain_context_pos_builder = ChainContextPosBuilder(ttfont, None)
         chain_context_pos_builder.rules.append(
-            ChainContextualRule([middle + right], [right], [], [[lookup]]))
+            ChainContextualRule([middle_right], [right], [], [[lookup]]))
         lookup = chain_context_pos_builder.build()
         assert lookup
         lookup_indices.append(len(lookups))
@@ -407,10 +554,17 @@ class EastAsianSpacing(object):
 
     async def add_glyphs(self, font, config):
         assert not font.is_vertical
-        await self.horizontal.add_glyphs(font, config)
         vertical_font = font.vertical_font
-        if vertical_font:
-            await self.vertical.add_glyphs(vertical_font, config)
+        if not vertical_font:
+            await self.horizontal.add_glyphs(font, config)
+            return
+        # The vertical font also shapes the horizontal font, which needs
+        # `fullwidth_advance`. Ensure it before running them in parallel.
+        await Shaper.ensure_fullwidth_advance(font)
+        # They don't share `GlyphTypeCache`; it is per horizontal or vertical
+        # root font.
+        await asyncio.gather(self.horizontal.add_glyphs(font, config),
+                             self.vertical.add_glyphs(vertical_font, config))
 
     @staticmethod
     def font_has_feature(font):
@@ -435,6 +589,7 @@ class EastAsianSpacing(object):
             gpos = font.add_gpos_table()
         table = gpos.table
         assert table
+        font.set_table_modified('GPOS')
 
         if self.horizontal.can_add_to_table:
             self.horizontal.add_to_table(font, table, 'chws')
@@ -3,7 +3,13 @@ import os
 import pathlib
 import tempfile
 
+from fontTools.ttLib import TTCollection
+from fontTools.ttLib import TTFont
+import pytest
+
 from east_asian_spacing import Builder
+from east_asian_spacing import Config
+from east_asian_spacing import Font
 
 
 def test_calc_output_path(data_dir):
@@ -50,3 +56,29 @@ def test_expand_paths(monkeypatch):
     assert call(['-']) == ['line1', 'line2']
     monkeypatch.setattr('sys.stdin', io.StringIO('line1\nline2\n'))
     assert call(['a', '-', 'b']) == ['a', 'line1', 'line2', 'b']
+
+
+@pytest.mark.asyncio
+async def test_build_collection_different_gpos(test_font_path, tmp_path):
+    # Make a collection of two faces that do not share `GPOS`, so that they
+    # are built to separate `EastAsianSpacing`s.
+    ttfont0 = TTFont(test_font_path)
+    ttfont1 = TTFont(test_font_path)
+    del ttfont1['GPOS']
+    ttcollection = TTCollection()
+    ttcollection.fonts = [ttfont0, ttfont1]
+    ttc_path = tmp_path / 'test.ttc'
+    ttcollection.save(ttc_path)
+
+    font = Font.load(ttc_path)
+    config = Config.for_collection(font, languages='JAN,ZHS')
+    builder = Builder(font, config)
+    await builder.build()
+    assert builder.has_spacings
+    spacing = builder._united_spacings()
+    spacing.horizontal.assert_glyphs_are_disjoint()
+    spacing.vertical.assert_glyphs_are_disjoint()
+    out_dir = tmp_path / 'out'
+    out_dir.mkdir()
+    builder.save(out_dir)
+    await builder.test(smoke=False)
@@ -3,6 +3,8 @@ import sys
 import pathlib
 import pytest
 
+import east_asian_spacing.spacing
+
 _test_dir = pathlib.Path(__file__).resolve().parent
 _root_dir = _test_dir.parent
 _data_dir = _test_dir / 'data'
@@ -10,6 +12,9 @@ _fonts_dir = _root_dir / 'fonts'
 _package_dir = _root_dir / 'east_asian_spacing'
 sys.path.append(str(_package_dir))
 
+# Tests also check the assumptions about languages.
+east_asian_spacing.spacing._ASSERTIONS_ENABLED = True
+
 
 @pytest.fixture(scope="session")
 def data_dir():
@@ -4,6 +4,7 @@ import pytest
 
 from east_asian_spacing import Dump
 from east_asian_spacing import Font
+from east_asian_spacing import TableEntry
 
 diff_params = [None]
 if shutil.which('diff'):
@@ -32,6 +33,17 @@ def test_has_table_diff_head(data_dir):
     assert Dump.has_table_diff(data_dir / 'head-diff.ttx.diff', 'head')
 
 
+def test_tags_by_index():
+    entries = [
+        TableEntry(None, 'glyf', 0, 10, [0, 1, 2]),
+        TableEntry(None, 'head', 10, 10, [0]),
+        TableEntry(None, 'head', 20, 10, [1, 2]),
+        TableEntry(None, 'name', 30, 10, [2]),
+    ]
+    assert TableEntry.tags_by_index(entries, 4) == [['glyf', 'head'], ['head'],
+                                                    ['name'], []]
+
+
 def test_read_split_table_ttx(data_dir):
     tables = Dump.read_split_table_ttx(data_dir / 'split-table.ttx')
     assert list(tables.keys()) == ['head', 'hmtx']
@@ -1,4 +1,5 @@
 from east_asian_spacing import Font
+from east_asian_spacing.font import _LazyFontList
 
 
 def test_is_font_extension():
@@ -22,6 +23,24 @@ def test_is_font_extension():
     assert not Font.is_ttc_font_extension('.ttf')
 
 
+def test_lazy_font_list():
+    created = []
+
+    def create_font(index):
+        created.append(index)
+        return f'font{index}'
+
+    fonts = _LazyFontList(3, create_font)
+    assert len(fonts) == 3
+    assert created == []
+    assert fonts[1] == 'font1'
+    assert fonts[-2] == 'font1'
+    assert created == [1]
+    assert list(fonts.created_fonts()) == ['font1']
+    assert list(fonts) == ['font0', 'font1', 'font2']
+    assert created == [1, 0, 2]
+
+
 def test_vertical_font(test_font_path):
     font = Font.load(test_font_path)
     assert font.is_root
@@ -33,3 +52,14 @@ def test_vertical_font(test_font_path):
     assert vertical_font.root_or_self == font
 
     assert list(font.self_and_derived_fonts()) == [font, vertical_font]
+
+
+def test_feature_tags_raw(test_font_path):
+    font = Font.load(test_font_path)
+    for tag in ('GSUB', 'GPOS'):
+        raw = font._feature_tags_raw(tag)
+        assert raw == font._feature_tags(tag)
+        table = font.tttable(tag).table
+        assert raw == set(
+            feature_record.FeatureTag
+            for feature_record in table.FeatureList.FeatureRecord)
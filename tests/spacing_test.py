@@ -1,3 +1,8 @@
+from fontTools.fontBuilder import FontBuilder
+from fontTools.ttLib import TTCollection
+from fontTools.ttLib.tables._g_l_y_f import Glyph
+import pytest
+
 from east_asian_spacing import Config
 from east_asian_spacing import Font
 from east_asian_spacing import GlyphSetTrio
@@ -35,3 +40,82 @@ def test_cache(test_font_path):
     assert trio2.right == {2}
     assert trio2.middle == {3}
     assert glyphs == {4}
+
+
+def _build_ttfont(cmap):
+    # Build a minimal TrueType font without glyph names in `post`.
+    builder = FontBuilder(1000, isTTF=True)
+    names = ('.notdef', 'glyph1', 'glyph2')
+    builder.setupGlyphOrder(names)
+    builder.setupCharacterMap(cmap)
+    builder.setupGlyf({name: Glyph() for name in names})
+    builder.setupHorizontalMetrics({name: (1000, 0) for name in names})
+    builder.setupHorizontalHeader()
+    builder.setupPost(keepGlyphNames=False)
+    return builder.font
+
+
+@pytest.mark.asyncio
+async def test_shape_cache_evicts_failures(monkeypatch, tmp_path):
+    path = tmp_path / 'test.ttf'
+    _build_ttfont({0x3008: 'glyph1'}).save(path)
+    font = Font.load(path)
+    calls = []
+
+    async def shape_glyphs(font, text, language):
+        calls.append(text)
+        if len(calls) == 1:
+            raise ValueError()
+        return frozenset({1})
+
+    monkeypatch.setattr(GlyphSetTrio, '_shape_glyphs', shape_glyphs)
+    with pytest.raises(ValueError):
+        await GlyphSetTrio._shape(font, {0x3008})
+    assert await GlyphSetTrio._shape(font, {0x3008}) == {1}
+    assert await GlyphSetTrio._shape(font, {0x3008}) == {1}
+    assert len(calls) == 2
+
+
+def test_glyph_names_post_format_3(tmp_path):
+    # Glyph names of TrueType fonts with `post` format 3 are derived from
+    # `cmap`, so faces sharing `post` may have different names.
+    # The second face does not map `glyph2` in its `cmap`.
+    cmap = {0x3008: 'glyph1', 0x3009: 'glyph2'}
+    ttcollection = TTCollection()
+    ttcollection.fonts = [
+        _build_ttfont(cmap),
+        _build_ttfont({0x3008: 'glyph1'})
+    ]
+    path = tmp_path / 'test.ttc'
+    ttcollection.save(path)
+
+    font = Font.load(path)
+    trio = GlyphSetTrio({1}, {2})
+    for face in font.fonts_in_collection:
+        left, right, *_ = trio._glyph_names(face)
+        assert left == (face.ttfont.getGlyphName(1), )
+        assert right == (face.ttfont.getGlyphName(2), )
+
+
+def test_glyph_type_cache():
+    cache = GlyphSetTrio.GlyphTypeCache()
+    cache.add_trio(GlyphSetTrio({1}, {300}, {3}))
+    assert cache.type_from_glyph_id(1) == "L"
+    assert cache.type_from_glyph_id(3) == "M"
+    assert cache.type_from_glyph_id(300) == "R"
+    assert cache.type_from_glyph_id(2) is None
+    assert cache.type_from_glyph_id(1000) is None
+    trio = GlyphSetTrio()
+    glyphs = cache.add_to_trio(trio, {1, 2, 3, 300, 1000})
+    assert trio.left == {1}
+    assert trio.right == {300}
+    assert trio.middle == {3}
+    assert glyphs == {2, 1000}
+
+
+def test_unite_many():
+    trio = GlyphSetTrio({1}, None, {5})
+    trio.unite_many((GlyphSetTrio({2}, {3}), None, GlyphSetTrio(None, {4})))
+    assert trio.left == {1, 2}
+    assert trio.right == {3, 4}
+    assert trio.middle == {5}